@@ -12,29 +12,49 @@
 # See the Apache License Version 2.0 for the specific language governing permissions and limitations there under.
 
 import os
+from base64 import urlsafe_b64decode
 from dataclasses import dataclass
 from enum import Enum
-from json import JSONDecodeError, dumps, load
-from os.path import join, dirname
+from json import JSONDecodeError, dumps, loads
+from os.path import join, dirname, expanduser
 import logging
+import re
 import sys
 import argparse
-from typing import Dict, Literal, Optional, TextIO, cast
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, Tuple, cast
 
-from dotenv import load_dotenv
-from requests import get, post, RequestException, Response
+# orjson, dotenv, requests and other modules that only some actions need are imported where they are
+# used, so that `--help` and argument errors do not pay for loading them.
+if TYPE_CHECKING:
+    from requests import Response, Session
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 dotenv_path = join(dirname(__file__), '.env')
-load_dotenv(dotenv_path)
+
+# Size of the HTTP connection pool, and number of data structures processed concurrently in batch mode
+MAX_CONNECTIONS = 4
+
+# orjson only keeps integers that fit in 64 bits and turns longer ones into floats; documents with
+# numbers this long are decoded with the standard library instead
+LONG_NUMBER = re.compile(rb'\d{19,}')
+
+# SchemaVer MODEL-REVISION-ADDITION, with plain decimal parts only: int() alone would also accept and
+# rewrite forms such as '01', '1_0', '+1' or non-ASCII digits, so the deployed version would differ
+VERSION = re.compile(r'(0|[1-9][0-9]*)-(0|[1-9][0-9]*)-(0|[1-9][0-9]*)')
+
+# Cached tokens are not reused when they expire within this many seconds
+TOKEN_EXPIRY_MARGIN = 60
 
 
 class CLIArguments(argparse.Namespace):
     token_only: bool
     token: str | None
-    file: TextIO
+    file: str | None
+    batch: str | None
     type: Literal["event", "entity"]
     includes_meta: bool
     promote_to_dev: bool
@@ -43,23 +63,27 @@ class CLIArguments(argparse.Namespace):
     message: str | None
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config:
     console_host: str
     organization_id: str
     api_key: str
     base_url: str
     ds_url: str
+    token_url: str
+    validation_url: str
+    deployment_url: str
+    cache_dir: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class DataStructure:
     vendor: str
     name: str
     format: str
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Version:
     model: int
     revision: int
@@ -69,20 +93,88 @@ class Version:
         return f"{self.model}-{self.revision}-{self.addition}"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Deployment:
     data_structure: DataStructure
     version: Version
 
 
+@dataclass(frozen=True, slots=True)
+class InputDocument:
+    data_structure: dict
+    raw: bytes
+    deployment: Deployment
+
+
 class SchemaType(str, Enum):
     EVENT = 'event'
     ENTITY = 'entity'
 
 
+def json_loads(data: bytes) -> Any:
+    """
+    Decodes a JSON document, with orjson where it yields the same result as the standard library.
+
+    The standard library is used for documents with integers beyond 64 bits, which orjson would turn into
+    floats, and for documents orjson rejects, such as ones with NaN or Infinity literals.
+
+    :param data: The UTF-8 encoded document
+    :return: The decoded document
+    """
+    import orjson
+
+    if not LONG_NUMBER.search(data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    # Decode explicitly: given bytes, the standard library would also accept UTF-16, UTF-32 and a UTF-8 BOM,
+    # none of which can be sent on as the raw request body
+    return loads(data.decode('utf-8'))
+
+
+def json_dumps(value: Any) -> bytes:
+    """
+    Encodes a value as JSON, with orjson unless it holds integers beyond 64 bits.
+
+    Note that orjson encodes NaN and Infinity as null.
+
+    :param value: The value to encode
+    :return: The UTF-8 encoded document
+    """
+    import orjson
+
+    try:
+        return orjson.dumps(value)
+    except TypeError:
+        return dumps(value).encode()
+
+
+@lru_cache(maxsize=None)
+def get_session() -> "Session":
+    """
+    Returns the HTTP session shared by all API calls.
+
+    A single session lets the token request and the subsequent validation or
+    promotion request share one keep-alive connection to BDP Console.
+    """
+    from requests import Session
+    from requests.adapters import HTTPAdapter
+
+    session = Session()
+    session.mount("https://", HTTPAdapter(pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS))
+    return session
+
+
 def get_config() -> Optional[Config]:
     """Returns an endpoint configuration object"""
 
+    # Most CI runs set the environment directly and have no .env file; skip importing dotenv then
+    if os.path.isfile(dotenv_path):
+        from dotenv import load_dotenv
+
+        load_dotenv(dotenv_path)
+
     try:
         org_id = os.environ['CONSOLE_ORGANIZATION_ID']
         api_key = os.environ['CONSOLE_API_KEY']
@@ -91,52 +183,174 @@ def get_config() -> Optional[Config]:
         return None
 
     host = os.environ.get('CONSOLE_HOST', 'console')
+    cache_home = os.environ.get('XDG_CACHE_HOME') or join(expanduser('~'), '.cache')
     base_url = f"https://{host}.snowplowanalytics.com/api/msc/v1/organizations/{org_id}"
+    ds_url = f"{base_url}/data-structures/v1"
 
     return Config(
         console_host=host,
         organization_id=org_id,
         api_key=api_key,
         base_url=base_url,
-        ds_url=f"{base_url}/data-structures/v1"
+        ds_url=ds_url,
+        token_url=f"{base_url}/credentials/v2/token",
+        validation_url=f"{ds_url}/validation-requests",
+        deployment_url=f"{ds_url}/deployment-requests",
+        cache_dir=join(cache_home, 'dsctl'),
     )
 
 
+def get_token_cache_path(config: Config) -> str:
+    """
+    Returns the path of the file caching the access token for this configuration.
+
+    The file name is derived from a hash of the host, organization and API key, so that
+    different credentials never share a cached token.
+    """
+    from hashlib import sha256
+
+    key = sha256(f"{config.console_host}:{config.organization_id}:{config.api_key}".encode()).hexdigest()
+    return join(config.cache_dir, f"token-{key[:16]}.json")
+
+
+def get_token_expiry(token: str) -> Optional[int]:
+    """
+    Extracts the expiration time from a JWT, without verifying it.
+
+    :param token: The JWT
+    :return: The `exp` claim as a UNIX timestamp, or None if the token does not carry one
+    """
+    try:
+        payload = token.split('.')[1]
+        claims = json_loads(urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return int(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def read_cached_token(path: str) -> Optional[str]:
+    """
+    Reads a previously cached access token.
+
+    :param path: The cache file
+    :return: The token, or None if there is no cached token or it is about to expire
+    """
+    try:
+        with open(path, 'rb') as file:
+            cached = json_loads(file.read())
+        if time.time() + TOKEN_EXPIRY_MARGIN >= cached['exp']:
+            return None
+        return cast(str, cached['token'])
+    except (OSError, KeyError, TypeError, ValueError):
+        return None
+
+
+def write_cached_token(path: str, token: str) -> None:
+    """
+    Caches an access token until it expires. Tokens without an expiration time are not cached.
+
+    :param path: The cache file
+    :param token: The JWT to cache
+    """
+    exp = get_token_expiry(token)
+    if exp is None:
+        return
+
+    import tempfile
+
+    try:
+        cache_dir = dirname(path)
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        # mkstemp creates the file readable by the current user only
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(json_dumps({"token": token, "exp": exp}))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logger.warning("Could not cache access token in %s: %s", path, e)
+
+
+def discard_cached_token(config: Config, token: str) -> None:
+    """
+    Removes the cached access token if it is the given one, e.g. after BDP Console rejected it.
+
+    :param config: Endpoint configuration object
+    :param token: The rejected JWT
+    """
+    path = get_token_cache_path(config)
+    if read_cached_token(path) != token:
+        return
+    try:
+        os.remove(path)
+        logger.warning("Discarded the cached access token rejected by BDP Console; retry to request a new one")
+    except FileNotFoundError:
+        # Another batch worker that got the same rejection removed it first
+        pass
+    except OSError as e:
+        logger.warning("Could not remove cached access token %s: %s", path, e)
+
+
 def get_token(config: Config) -> Optional[str]:
     """
-    Retrieves a JWT from BDP Console.
+    Retrieves a JWT from BDP Console, reusing a cached one while it is still valid.
+
+    :return: The token
+    """
+    cache_path = get_token_cache_path(config)
+    token = read_cached_token(cache_path)
+    if token:
+        return token
+
+    token = request_token(config)
+    if token:
+        write_cached_token(cache_path, token)
+    return token
+
+
+def request_token(config: Config) -> Optional[str]:
+    """
+    Requests a new JWT from BDP Console.
 
     :return: The token
     """
+    from requests import RequestException
+
     response = None
     body = None
     try:
-        response = get(
-            f"{config.base_url}/credentials/v2/token",
+        response = get_session().get(
+            config.token_url,
             headers={"X-API-Key": config.api_key}
         )
-        body = response.json()
+        body = json_loads(response.content)
         if not isinstance(body, dict):
             raise TypeError()
         return cast(str, body["accessToken"])
     except RequestException as e:
-        logger.error(f"Could not contact BDP Console: {e}")
+        logger.error("Could not contact BDP Console: %s", e)
         return None
     except JSONDecodeError:
-        logger.error(f"get_token: Response was not valid JSON: {response and response.text}")
+        logger.error("request_token: Response was not valid JSON: %s", response and response.text)
         return None
     except (KeyError, TypeError):
-        logger.error(f"get_token: Invalid response body: {dumps(body, indent=2)}")
+        if logger.isEnabledFor(logging.ERROR):
+            logger.error("request_token: Invalid response body: %s", dumps(body, indent=2))
         return None
 
 
 def get_base_headers(auth_token: str) -> Dict[str, str]:
+    # Request bodies are encoded by dsctl and sent as `data`, so the content type is set here
     return {
-        "Authorization": f"Bearer {auth_token}"
+        "Authorization": f"Bearer {auth_token}",
+        "Content-Type": "application/json",
     }
 
 
-def handle_response(response: Response, action: str) -> bool:
+def handle_response(response: "Response", action: str) -> bool:
     """
     Generic response handler for validation and promotion operations. Confirms that it all went well.
 
@@ -146,20 +360,27 @@ def handle_response(response: Response, action: str) -> bool:
     """
     if response.ok:
         try:
-            body = response.json()
+            body = json_loads(response.content)
             if not isinstance(body, dict) or not body.get("success"):
-                logger.error(f"Data structure {action} failed: {body}")
+                logger.error("Data structure %s failed: %s", action, body)
                 return False
             return True
         except JSONDecodeError:
-            logger.error(f"handle_response: Response was not valid JSON: {response.text}")
+            logger.error("handle_response: Response was not valid JSON: %s", response.text)
             return False
     else:
-        logger.error(f"Data structure {action} failed: {response.text}")
+        logger.error("Data structure %s failed: %s", action, response.text)
         return False
 
 
-def validate(config: Config, data_structure: dict, auth_token: str, stype: str, contains_meta: bool) -> bool:
+def validate(
+    config: Config,
+    data_structure: dict,
+    auth_token: str,
+    stype: str,
+    contains_meta: bool,
+    raw_data_structure: Optional[bytes] = None,
+) -> bool:
     """
     Validates a data structure against the BDP API.
 
@@ -168,29 +389,39 @@ def validate(config: Config, data_structure: dict, auth_token: str, stype: str,
     :param auth_token: The JWT to use
     :param stype: The type of the data structure (event or entity)
     :param contains_meta: A flag to indicate whether the `meta` section already exists in the dictionary
+    :param raw_data_structure: The JSON document `data_structure` was parsed from, sent without re-encoding
     :return:
     """
     if stype not in (SchemaType.EVENT, SchemaType.ENTITY):
         logger.error('Data structure type must be either "event" or "entity"')
         return False
 
+    from requests import RequestException
+
+    # The input document is sent exactly as written when available, never re-encoded
+    data = raw_data_structure if raw_data_structure is not None else json_dumps(data_structure)
+    if contains_meta:
+        body = data
+    else:
+        meta = json_dumps({
+            "hidden": False,
+            "schemaType": stype,
+            "customData": {}
+        })
+        body = b'{"meta":' + meta + b',"data":' + data + b'}'
+
     try:
-        response = post(
-            f"{config.ds_url}/validation-requests",
-            json={
-                "meta": {
-                    "hidden": False,
-                    "schemaType": stype,
-                    "customData": {}
-                },
-                "data": data_structure
-            } if not contains_meta else data_structure,
+        response = get_session().post(
+            config.validation_url,
+            data=body,
             headers=get_base_headers(auth_token)
         )
     except RequestException as e:
-        logger.error(f"Could not contact BDP Console: {e}")
+        logger.error("Could not contact BDP Console: %s", e)
         return False
 
+    if response.status_code in (401, 403):
+        discard_cached_token(config, auth_token)
     return handle_response(response, 'validation')
 
 
@@ -213,26 +444,29 @@ def promote(
     :param request_patch: A flag to indicate if the data structure deployment should request patch support (default: False)
     :return: None
     """
+    from requests import RequestException
+
     try:
-        response = post(
-            f"{config.ds_url}/deployment-requests",
-            json={
+        response = get_session().post(
+            config.deployment_url,
+            data=json_dumps({
                 "name": deployment.data_structure.name,
                 "vendor": deployment.data_structure.vendor,
                 "format": deployment.data_structure.format,
-                "version": "{}-{}-{}".format(deployment.version.model, deployment.version.revision,
-                                             deployment.version.addition),
+                "version": str(deployment.version),
                 "source": "VALIDATED" if not to_production else "DEV",
                 "target": "DEV" if not to_production else "PROD",
                 "message": deployment_message
-            },
+            }),
             params=dict(patch=request_patch),
             headers=get_base_headers(auth_token),
         )
     except RequestException as e:
-        logger.error(f"Could not contact BDP Console: {e}")
+        logger.error("Could not contact BDP Console: %s", e)
         return False
 
+    if response.status_code in (401, 403):
+        discard_cached_token(config, auth_token)
     return handle_response(response, 'promotion')
 
 
@@ -257,7 +491,10 @@ def resolve(data_structure: dict | None, includes_meta: bool) -> Optional[Deploy
         ds_format = _self['format']
         version = _self['version']
         ds = DataStructure(vendor, name, ds_format)
-        v = Version(*version.split('-'))
+        match = VERSION.fullmatch(version)
+        if not match:
+            raise ValueError()
+        v = Version(*map(int, match.groups()))
         return Deployment(ds, v)
     except (ValueError, TypeError):
         logger.error("Data structure spec is incorrect: Vendor, name, format or version is invalid")
@@ -271,23 +508,31 @@ def parse_arguments() -> CLIArguments:
     """Parses and returns CLI parameters"""
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--token-only", action="store_true", help="only get an access token and print it on stdout")
+    # The actions are mutually exclusive; validation is the default when none is given.
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument("--token-only", action="store_true", help="only get an access token and print it on stdout")
+    action.add_argument("--promote-to-dev", action="store_true",
+                        help="promote from validated to dev; reads parameters from stdin or --file parameter")
+    action.add_argument("--promote-to-prod", action="store_true",
+                        help="promote from dev to prod; reads parameters from stdin or --file parameter")
     parser.add_argument("--token", type=str, help="use this token to authenticate")
-    parser.add_argument(
+    # Only opened by the actions that read a data structure, never for --token-only
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument(
         "--file",
-        type=argparse.FileType(),
-        default="-",
-        help="read data structure from file (absolute path) instead of stdin",
+        type=str,
+        help="read data structure from file instead of stdin",
+    )
+    source.add_argument(
+        "--batch",
+        type=str,
+        help="validate or promote all data structure files listed, one per line, in this file (- for stdin)",
     )
     parser.add_argument(
         "--type", choices=("event", "entity"), default="event", help="document type"
     )
     parser.add_argument("--includes-meta", action="store_true",
                         help="the input document already contains the meta field")
-    parser.add_argument("--promote-to-dev", action="store_true",
-                        help="promote from validated to dev; reads parameters from stdin or --file parameter")
-    parser.add_argument("--promote-to-prod", action="store_true",
-                        help="promote from dev to prod; reads parameters from stdin or --file parameter")
     parser.add_argument(
         "--allow-patch",
         action="store_true",
@@ -295,51 +540,153 @@ def parse_arguments() -> CLIArguments:
     )
     parser.add_argument("--message", type=str, help="message to add to version deployment")
 
-    return parser.parse_args(namespace=CLIArguments())
+    arguments = parser.parse_args(namespace=CLIArguments())
+    # argparse cannot put --batch in both groups, so this combination is rejected here
+    if arguments.token_only and arguments.batch:
+        parser.error("argument --batch: not allowed with argument --token-only")
+    return arguments
 
 
-def parse_input_file(file: TextIO) -> Optional[dict]:
+def parse_input_file(path: str | None) -> Optional[Tuple[dict, bytes]]:
     """
     Loads schema from a file or standard input.
 
-    :param file: File to read from
-    :return: The schema JSON
+    :param path: Path of the file to read from; standard input is used when None or `-`
+    :return: The schema JSON, along with the raw document it was parsed from
     """
+    from_stdin = not path or path == "-"
     try:
-        return load(file)
+        if from_stdin:
+            raw = sys.stdin.buffer.read()
+        else:
+            with open(cast(str, path), "rb") as file:
+                raw = file.read()
+        return json_loads(raw), raw
     except JSONDecodeError as e:
-        logger.error(f"Provided input is not valid JSON: {e}")
+        logger.error("Provided input is not valid JSON: %s", e)
         return None
     except Exception as e:
-        logger.error(f"Could not read {file.name if file.name else 'stdin'}: {e}")
+        logger.error("Could not read %s: %s", 'stdin' if from_stdin else path, e)
         return None
-    finally:
-        file.close()
 
 
-def flow(args: CLIArguments, config: Config) -> bool:
-    """Main operation actually invoking the DS API to validate or promote a data structure"""
+def read_input(path: str | None, includes_meta: bool) -> Optional[InputDocument]:
+    """
+    Reads a data structure and resolves its self-description.
 
-    message = args.message if args.message else "No message provided"
-    token = args.token if args.token else get_token(config)
-    schema = parse_input_file(args.file)
-    schema_type = args.type
-    spec = resolve(schema, args.includes_meta)
+    :param path: Path of the file to read from; standard input is used when None or `-`
+    :param includes_meta: A flag to indicate whether the `meta` section already exists in the document
+    :return: An InputDocument instance
+    """
+    parsed = parse_input_file(path)
+    if not parsed:
+        return None
+    data_structure, raw = parsed
+    deployment = resolve(data_structure, includes_meta)
+    if not data_structure or not deployment:
+        return None
+    return InputDocument(data_structure, raw, deployment)
 
-    if not token or not schema or not spec:
-        return False
+
+def process(args: CLIArguments, config: Config, token: str, document: InputDocument) -> bool:
+    """Validates or promotes a data structure, as requested by the CLI arguments"""
+
+    message = args.message if args.message else "No message provided"
 
     if args.promote_to_dev or args.promote_to_prod:
         return promote(
             config,
-            spec,
+            document.deployment,
             token,
             message,
             to_production=args.promote_to_prod,
             request_patch=args.allow_patch,
         )
     else:
-        return validate(config, schema, token, schema_type, args.includes_meta)
+        return validate(config, document.data_structure, token, args.type, args.includes_meta, document.raw)
+
+
+def flow(args: CLIArguments, config: Config) -> bool:
+    """Main operation actually invoking the DS API to validate or promote a data structure"""
+
+    # Invalid input fails before any network call is made
+    document = read_input(args.file, args.includes_meta)
+    if not document:
+        return False
+
+    token = args.token if args.token else get_token(config)
+    if not token:
+        return False
+
+    return process(args, config, token, document)
+
+
+def parse_batch_file(path: str) -> Optional[List[str]]:
+    """
+    Reads the list of data structure files to process in batch mode.
+
+    :param path: Path of a file listing one data structure file per line; standard input is used when `-`
+    :return: The listed paths, without blank lines
+    """
+    try:
+        if path == "-":
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(path) as file:
+                lines = file.read().splitlines()
+    except Exception as e:
+        logger.error("Could not read %s: %s", 'stdin' if path == '-' else path, e)
+        return None
+
+    paths = [line.strip() for line in lines if line.strip()]
+    if not paths:
+        logger.error("Batch file %s does not list any data structure files", 'stdin' if path == '-' else path)
+        return None
+    if "-" in paths:
+        logger.error("Batch file entries must be file paths; standard input (-) cannot be used")
+        return None
+    return paths
+
+
+def batch_flow(args: CLIArguments, config: Config) -> bool:
+    """
+    Validates or promotes every data structure listed in the batch file.
+
+    All files are read before any network call, and nothing is sent if one of them is invalid. Data
+    structures are then processed concurrently, in no particular order, sharing a single token and
+    the connection pool of the HTTP session.
+
+    :return: True if all data structures were processed successfully
+    """
+    paths = parse_batch_file(cast(str, args.batch))
+    if paths is None:
+        return False
+
+    documents = []
+    for path in paths:
+        document = read_input(path, args.includes_meta)
+        if not document:
+            logger.error("Could not process %s", path)
+            return False
+        documents.append(document)
+
+    token = args.token if args.token else get_token(config)
+    if not token:
+        return False
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Create the session before starting the workers: lru_cache does not prevent concurrent first calls
+    # from each building their own. The workers then share it: the token travels in per-request headers
+    # rather than session state, the cookie jar is lock-protected and urllib3's connection pool is thread-safe.
+    get_session()
+    with ThreadPoolExecutor(max_workers=MAX_CONNECTIONS) as executor:
+        results = list(executor.map(lambda document: process(args, config, token, document), documents))
+
+    for path, succeeded in zip(paths, results):
+        if not succeeded:
+            logger.error("Could not process %s", path)
+    return all(results)
 
 
 def main() -> None:
@@ -354,6 +701,9 @@ def main() -> None:
         if not token:
             sys.exit(1)
         sys.stdout.write(token)
+    elif arguments.batch:
+        if not batch_flow(arguments, config):
+            sys.exit(1)
     else:
         if not flow(arguments, config):
             sys.exit(1)
@@ -2,67 +2,100 @@ import argparse
 import io
 import os
 import sys
-from copy import deepcopy
-from json import JSONDecodeError, dumps
+import time
+from base64 import urlsafe_b64encode
+from dataclasses import replace
+from json import dumps
+from types import SimpleNamespace
 
 import pytest
 import responses
-from requests import Response
 from responses import matchers
 
 import dsctl
 
 
-@pytest.fixture
-def environment(mocker):
-    mocker.patch.dict(
-        os.environ, {
-            'CONSOLE_ORGANIZATION_ID': 'CONSOLE_ID',
-            'CONSOLE_API_KEY': 'api-key'
-        }
-    )
-
-
-@pytest.fixture
+# Shared by reference between tests, which must not mutate them
+DATA_STRUCTURE = {
+    "self": {
+        "vendor": "com.snowplow",
+        "name": "transaction",
+        "format": "jsonschema",
+        "version": "1-0-0"
+    }
+}
+DATA_STRUCTURE_JSON = dumps(DATA_STRUCTURE).encode()
+DATA_STRUCTURE_WITH_META = {
+    "meta": {
+        "hidden": False,
+        "schemaType": "event",
+        "customData": {}
+    },
+    "data": DATA_STRUCTURE
+}
+
+
+def make_jwt(exp):
+    payload = urlsafe_b64encode(dumps({"exp": exp}).encode()).rstrip(b'=').decode()
+    return f"header.{payload}.signature"
+
+
+@pytest.fixture(scope="module")
+def environment(tmp_path_factory):
+    # pytest-mock's mocker is function-scoped, so patch the environment once for the whole module here
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv('CONSOLE_ORGANIZATION_ID', 'CONSOLE_ID')
+        mp.setenv('CONSOLE_API_KEY', 'api-key')
+        mp.setenv('XDG_CACHE_HOME', str(tmp_path_factory.mktemp("cache")))
+        yield
+
+
+@pytest.fixture(scope="module")
 def config(environment):
     return dsctl.get_config()
 
 
-@pytest.fixture
+@pytest.fixture(scope="module")
 def token_url(config):
     return f"{config.base_url}/credentials/v2/token"
 
 
+@pytest.fixture(scope="module")
+def requests_mock():
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rm:
+        yield rm
+
+
+# Installed once per module and reset after every test; unregistered URLs fail with ConnectionError
+@pytest.fixture(autouse=True)
+def mocked_responses(requests_mock):
+    yield requests_mock
+    requests_mock.reset()
+
+
+# The shared config, with a token cache of its own for tests that cache a token
 @pytest.fixture
-def throws_json_decode_error(mocker):
-    def throw():
-        raise JSONDecodeError('json decode error', "", 0)
+def isolated_config(config, tmp_path):
+    return replace(config, cache_dir=str(tmp_path))
 
-    return mocker.Mock(side_effect=throw)
+
+# handle_response only reads ok, content and text, so a plain namespace is enough
+@pytest.fixture(scope="module")
+def response_factory():
+    def make(ok=True, content=b''):
+        return SimpleNamespace(ok=ok, content=content, text=content.decode())
+
+    return make
 
 
 @pytest.fixture
 def data_structure():
-    return {
-        "self": {
-            "vendor": "com.snowplow",
-            "name": "transaction",
-            "format": "jsonschema",
-            "version": "1-0-0"
-        }
-    }
+    return DATA_STRUCTURE
 
 
 @pytest.fixture
-def data_structure_with_meta(data_structure):
-    return {
-        "meta": {
-            "hidden": False,
-            "schemaType": "event",
-            "customData": {}
-        },
-        "data": data_structure
-    }
+def data_structure_with_meta():
+    return DATA_STRUCTURE_WITH_META
 
 
 @pytest.fixture
@@ -74,78 +107,123 @@ def deployment(data_structure):
             format=data_structure['self']['format']
         ),
         version=dsctl.Version(
-            *data_structure['self']['version'].split('-')
+            *map(int, data_structure['self']['version'].split('-'))
         )
     )
 
 
 @pytest.fixture
-def args(mocker, data_structure):
-    args = mocker.Mock()
-    mocker.patch.object(args, 'message', None)
-    mocker.patch.object(args, 'token', None)
-    mocker.patch.object(args, 'file', io.StringIO(dumps(data_structure)))
-    mocker.patch.object(args, 'type', None)
-    mocker.patch.object(args, 'includes_meta', False)
-
-    return args
+def args(mocker):
+    mocker.patch.object(sys, 'stdin', io.TextIOWrapper(io.BytesIO(DATA_STRUCTURE_JSON)))
+    return SimpleNamespace(
+        token_only=False,
+        token=None,
+        file=None,
+        batch=None,
+        type='event',
+        includes_meta=False,
+        promote_to_dev=False,
+        promote_to_prod=False,
+        allow_patch=False,
+        message=None,
+    )
 
 
-def test_config_no_env():
+def test_config_no_env(monkeypatch):
+    monkeypatch.delenv('CONSOLE_ORGANIZATION_ID', raising=False)
+    monkeypatch.delenv('CONSOLE_API_KEY', raising=False)
     assert dsctl.get_config() is None
 
 
-@responses.activate
+def test_config_from_dotenv(mocker, tmp_path):
+    dotenv_path = tmp_path / '.env'
+    dotenv_path.write_text("CONSOLE_ORGANIZATION_ID=CONSOLE_ID\nCONSOLE_API_KEY=api-key\nCONSOLE_HOST=dev\n")
+    mocker.patch.object(dsctl, 'dotenv_path', str(dotenv_path))
+    mocker.patch.dict(os.environ, {'CONSOLE_API_KEY': 'other-key'})
+    config = dsctl.get_config()
+    assert config is not None
+    assert (config.organization_id, config.api_key, config.console_host) == ('CONSOLE_ID', 'other-key', 'dev')
+
+
 def test_get_token_connection_failure(config):
     assert dsctl.get_token(config) is None
 
 
-@responses.activate
-def test_get_token_status_failure(config, token_url):
-    responses.add(responses.GET, token_url, status=403)
+def test_get_token_status_failure(mocked_responses, config, token_url):
+    mocked_responses.add(responses.GET, token_url, status=403)
     assert dsctl.get_token(config) is None
 
 
-@responses.activate
-def test_get_token_json_failure(config, token_url):
-    responses.add(responses.GET, token_url, json={}, status=200)
+def test_get_token_json_failure(mocked_responses, config, token_url):
+    mocked_responses.add(responses.GET, token_url, json={}, status=200)
     assert dsctl.get_token(config) is None
 
 
-@responses.activate
-def test_get_token_success(config, token_url):
-    responses.add(responses.GET, token_url, json={"accessToken": "abcd"}, status=200)
+def test_get_token_success(mocked_responses, config, token_url):
+    mocked_responses.add(responses.GET, token_url, json={"accessToken": "abcd"}, status=200)
     assert dsctl.get_token(config) == "abcd"
 
 
-def test_handle_response_not_ok(mocker):
-    response = mocker.Mock(spec=Response)
-    mocker.patch.object(response, 'ok', False)
-    assert dsctl.handle_response(response, '') is False
+def test_get_token_reuses_cached_token(mocked_responses, isolated_config, token_url):
+    token = make_jwt(int(time.time()) + 3600)
+    mocked_responses.add(responses.GET, token_url, json={"accessToken": token}, status=200)
+    assert dsctl.get_token(isolated_config) == token
+    assert dsctl.get_token(isolated_config) == token
+    assert len(mocked_responses.calls) == 1
+
+
+def test_get_token_refreshes_expiring_token(mocked_responses, isolated_config, token_url):
+    expiring = make_jwt(int(time.time()) + dsctl.TOKEN_EXPIRY_MARGIN - 1)
+    mocked_responses.add(responses.GET, token_url, json={"accessToken": expiring}, status=200)
+    mocked_responses.add(responses.GET, token_url, json={"accessToken": "abcd"}, status=200)
+    assert dsctl.get_token(isolated_config) == expiring
+    assert dsctl.get_token(isolated_config) == "abcd"
+
 
+@pytest.mark.parametrize("status", [401, 403])
+def test_rejected_cached_token_is_discarded(mocked_responses, isolated_config, token_url, status):
+    token = make_jwt(int(time.time()) + 3600)
+    mocked_responses.add(responses.GET, token_url, json={"accessToken": token}, status=200)
+    mocked_responses.add(responses.POST, isolated_config.validation_url, status=status)
+    assert dsctl.get_token(isolated_config) == token
+    assert dsctl.validate(isolated_config, {}, token, "event", False) is False
+    assert dsctl.read_cached_token(dsctl.get_token_cache_path(isolated_config)) is None
 
-def test_handle_response_not_json(mocker, throws_json_decode_error):
-    response = mocker.Mock(spec=Response)
-    mocker.patch.object(response, 'json', throws_json_decode_error)
-    assert dsctl.handle_response(response, '') is False
 
+def test_discarding_already_removed_token_is_silent(mocker, isolated_config):
+    token = make_jwt(int(time.time()) + 3600)
+    dsctl.write_cached_token(dsctl.get_token_cache_path(isolated_config), token)
+    # Simulates another worker removing the file between the check and the removal
+    mocker.patch.object(dsctl.os, 'remove', side_effect=FileNotFoundError)
+    warning = mocker.patch.object(dsctl.logger, 'warning')
+    dsctl.discard_cached_token(isolated_config, token)
+    warning.assert_not_called()
 
-def test_handle_response_not_valid_json(mocker):
-    response = mocker.Mock(spec=Response)
-    mocker.patch.object(response, 'json', mocker.Mock(return_value={}))
-    assert dsctl.handle_response(response, '') is False
 
+def test_other_token_rejection_keeps_cache(mocked_responses, isolated_config, token_url):
+    token = make_jwt(int(time.time()) + 3600)
+    mocked_responses.add(responses.GET, token_url, json={"accessToken": token}, status=200)
+    mocked_responses.add(responses.POST, isolated_config.validation_url, status=401)
+    assert dsctl.get_token(isolated_config) == token
+    assert dsctl.validate(isolated_config, {}, "other-token", "event", False) is False
+    assert dsctl.read_cached_token(dsctl.get_token_cache_path(isolated_config)) == token
 
-def test_handle_response_not_successful(mocker):
-    response = mocker.Mock(spec=Response)
-    mocker.patch.object(response, 'json', mocker.Mock(return_value={'success': False}))
-    assert dsctl.handle_response(response, '') is False
 
+def test_get_token_expiry():
+    assert dsctl.get_token_expiry(make_jwt(1234)) == 1234
+    assert dsctl.get_token_expiry("abcd") is None
+    assert dsctl.get_token_expiry("header.!!!.signature") is None
 
-def test_handle_response_successful(mocker):
-    response = mocker.Mock(spec=Response)
-    mocker.patch.object(response, 'json', mocker.Mock(return_value={'success': True}))
-    assert dsctl.handle_response(response, '') is True
+
+@pytest.mark.parametrize("ok,content,expected", [
+    (False, b'', False),  # not ok
+    (True, b'not json', False),  # not JSON
+    (True, b'{}', False),  # not valid JSON
+    (True, b'{"success": false}', False),  # not successful
+    (True, b'{"success": true}', True),  # successful
+])
+def test_handle_response(response_factory, ok, content, expected):
+    assert dsctl.handle_response(response_factory(ok=ok, content=content), '') is expected
 
 
 def test_validate_wrong_schema_type(config):
@@ -156,28 +234,29 @@ def test_validate_fail_gracefully_on_connection_error(config):
     assert dsctl.validate(config, {}, "", "event", False) is False
 
 
-@responses.activate
-def test_validate_meta_added_when_not_there(config):
-    responses.add(
+def test_validate_meta_added_when_not_there(mocked_responses, config):
+    mocked_responses.add(
         responses.POST,
         f"{config.ds_url}/validation-requests",
         status=200,
         json={"success": True},
-        match=[matchers.json_params_matcher({
-            "meta": {
-                "hidden": False,
-                "schemaType": "event",
-                "customData": {}
-            },
-            "data": {}
-        })]
+        match=[
+            matchers.header_matcher({"Content-Type": "application/json"}),
+            matchers.json_params_matcher({
+                "meta": {
+                    "hidden": False,
+                    "schemaType": "event",
+                    "customData": {}
+                },
+                "data": {}
+            }),
+        ]
     )
     assert dsctl.validate(config, {}, "", "event", False) is True
 
 
-@responses.activate
-def test_validate_meta_not_added_when_there(config):
-    responses.add(
+def test_validate_meta_not_added_when_there(mocked_responses, config):
+    mocked_responses.add(
         responses.POST,
         f"{config.ds_url}/validation-requests",
         status=200,
@@ -187,7 +266,18 @@ def test_validate_meta_not_added_when_there(config):
     assert dsctl.validate(config, {}, "", "event", True) is True
 
 
-@responses.activate
+def test_validate_raw_body_sent_as_is(mocked_responses, config):
+    raw = b'{"meta": {"hidden": true}, "data": {}}'
+    mocked_responses.add(
+        responses.POST,
+        f"{config.ds_url}/validation-requests",
+        status=200,
+        json={"success": True},
+    )
+    assert dsctl.validate(config, {}, "", "event", True, raw) is True
+    assert mocked_responses.calls[0].request.body == raw
+
+
 def test_promote_fails_gracefully_on_connection_error(config, deployment):
     assert dsctl.promote(
         config,
@@ -198,36 +288,23 @@ def test_promote_fails_gracefully_on_connection_error(config, deployment):
     ) is False
 
 
-@responses.activate
-def test_promote_sends_the_right_body_validated_dev(config, deployment):
-    responses.add(
+def test_validate_wraps_raw_body_without_reencoding(mocked_responses, config):
+    raw = b'{"maximum": 100000000000000000000}'
+    mocked_responses.add(
         responses.POST,
-        f"{config.ds_url}/deployment-requests",
+        f"{config.ds_url}/validation-requests",
         status=200,
         json={"success": True},
-        match=[matchers.json_params_matcher({
-            "name": deployment.data_structure.name,
-            "vendor": deployment.data_structure.vendor,
-            "format": deployment.data_structure.format,
-            "version": str(deployment.version),
-            "source": "VALIDATED",
-            "target": "DEV",
-            "message": "message"
-        })]
     )
-
-    assert dsctl.promote(
-        config,
-        deployment,
-        "abcd",
-        "message",
-        to_production=False
-    ) is True
+    assert dsctl.validate(config, {}, "", "event", False, raw) is True
+    assert mocked_responses.calls[0].request.body == (
+        b'{"meta":{"hidden":false,"schemaType":"event","customData":{}},"data":' + raw + b'}'
+    )
 
 
-@responses.activate
-def test_promote_sends_the_right_body_validated_prod(config, deployment):
-    responses.add(
+@pytest.mark.parametrize("to_production,source,target", [(False, "VALIDATED", "DEV"), (True, "DEV", "PROD")])
+def test_promote_sends_the_right_body(mocked_responses, config, deployment, to_production, source, target):
+    mocked_responses.add(
         responses.POST,
         f"{config.ds_url}/deployment-requests",
         status=200,
@@ -237,8 +314,8 @@ def test_promote_sends_the_right_body_validated_prod(config, deployment):
             "vendor": deployment.data_structure.vendor,
             "format": deployment.data_structure.format,
             "version": str(deployment.version),
-            "source": "DEV",
-            "target": "PROD",
+            "source": source,
+            "target": target,
             "message": "message"
         })]
     )
@@ -248,45 +325,109 @@ def test_promote_sends_the_right_body_validated_prod(config, deployment):
         deployment,
         "abcd",
         "message",
-        to_production=True
+        to_production=to_production
     ) is True
 
 
-def test_resolve_resolves_correctly(data_structure, data_structure_with_meta, deployment):
-    assert dsctl.resolve({}, True) is None  # Invalid input
-    assert dsctl.resolve(data_structure, True) is None  # no meta but includes_meta=True
-    assert dsctl.resolve(data_structure, False) == deployment  # no meta and includes_meta=False
-    assert dsctl.resolve(data_structure_with_meta, True) == deployment  # with meta and includes_meta=True
-    assert dsctl.resolve(data_structure_with_meta, False) is None  # with meta and includes_meta=False
+def self_without(data_structure, key):
+    return {'self': {k: v for k, v in data_structure['self'].items() if k != key}}
+
+
+def with_version(data_structure, version):
+    return {'self': {**data_structure['self'], 'version': version}}
+
+
+def test_resolve_invalid_input():
+    assert dsctl.resolve({}, True) is None
+
+
+@pytest.mark.parametrize("payload,includes_meta,resolves", [
+    ("data_structure", True, False),  # no meta but includes_meta=True
+    ("data_structure", False, True),  # no meta and includes_meta=False
+    ("data_structure_with_meta", True, True),  # with meta and includes_meta=True
+    ("data_structure_with_meta", False, False),  # with meta and includes_meta=False
+])
+def test_resolve_meta(request, deployment, payload, includes_meta, resolves):
+    expected = deployment if resolves else None
+    assert dsctl.resolve(request.getfixturevalue(payload), includes_meta) == expected
+
+
+@pytest.mark.parametrize("missing", ["vendor", "name", "format", "version"])
+def test_resolve_missing_key(data_structure, missing):
+    assert dsctl.resolve(self_without(data_structure, missing), False) is None
+
+
+@pytest.mark.parametrize("version", [
+    "incorrect", "1-0", "1-0-0-0", 100, "1_0-0-0", "01-0-0", " 1-0-0", "1-0-0 ", "+1-0-0", "-1-0-0", "\uff11-0-0"
+])
+def test_resolve_invalid_version(data_structure, version):
+    assert dsctl.resolve(with_version(data_structure, version), False) is None
+
+
+def test_filename_parsing(tmp_path, data_structure):
+    path = tmp_path / "data-structure.json"
+    path.write_bytes(DATA_STRUCTURE_JSON)
+    assert dsctl.parse_input_file(str(path)) == (data_structure, DATA_STRUCTURE_JSON)
+
+
+@pytest.mark.parametrize("path", [None, "-"])
+def test_stdin_parsing(mocker, data_structure, path):
+    mocker.patch.object(sys, 'stdin', io.TextIOWrapper(io.BytesIO(DATA_STRUCTURE_JSON)))
+    assert dsctl.parse_input_file(path) == (data_structure, DATA_STRUCTURE_JSON)
+
+
+def test_filename_parsing_empty_file(tmp_path):
+    path = tmp_path / "data-structure.json"
+    path.touch()
+    assert dsctl.parse_input_file(str(path)) is None
+
 
-    d = deepcopy(data_structure)
-    del d['self']['vendor']
-    assert dsctl.resolve(d, False) is None
+def test_filename_parsing_long_integers(tmp_path):
+    path = tmp_path / "data-structure.json"
+    path.write_bytes(b'{"maximum": 100000000000000000000}')
+    assert dsctl.parse_input_file(str(path))[0] == {"maximum": 100000000000000000000}
 
-    d = deepcopy(data_structure)
-    del d['self']['name']
-    assert dsctl.resolve(d, False) is None
 
-    d = deepcopy(data_structure)
-    del d['self']['format']
-    assert dsctl.resolve(d, False) is None
+def test_filename_parsing_non_finite_numbers(tmp_path):
+    path = tmp_path / "data-structure.json"
+    path.write_bytes(b'{"maximum": Infinity}')
+    assert dsctl.parse_input_file(str(path))[0] == {"maximum": float("inf")}
 
-    d = deepcopy(data_structure)
-    del d['self']['version']
-    assert dsctl.resolve(d, False) is None
 
-    d = deepcopy(data_structure)
-    d['self']['version'] = "incorrect"
-    assert dsctl.resolve(d, False) is None
+def test_json_dumps_long_integers():
+    assert dsctl.json_dumps({"maximum": 100000000000000000000}) == b'{"maximum": 100000000000000000000}'
 
 
-@responses.activate
-def test_main_flow_validate(mocker, args, config, token_url, data_structure, data_structure_with_meta):
-    mocker.patch.object(args, 'promote_to_dev', False)
-    mocker.patch.object(args, 'promote_to_prod', False)
-    mocker.patch.object(args, 'type', 'event')
-    responses.add(responses.GET, token_url, json={"accessToken": "abcd"}, status=200)
-    responses.add(
+def test_filename_parsing_missing_file(tmp_path):
+    assert dsctl.parse_input_file(str(tmp_path / "missing.json")) is None
+
+
+def test_filename_parsing_not_json(tmp_path):
+    path = tmp_path / "data-structure.json"
+    path.write_text("not json")
+    assert dsctl.parse_input_file(str(path)) is None
+
+
+@pytest.mark.parametrize("encoded", [
+    b'\xef\xbb\xbf' + DATA_STRUCTURE_JSON,  # UTF-8 with BOM
+    DATA_STRUCTURE_JSON.decode().encode('utf-16'),
+    DATA_STRUCTURE_JSON.decode().encode('utf-16-le'),
+])
+def test_filename_parsing_not_utf8(tmp_path, encoded):
+    path = tmp_path / "data-structure.json"
+    path.write_bytes(encoded)
+    assert dsctl.parse_input_file(str(path)) is None
+
+
+def test_main_flow_invalid_input_skips_token_request(mocked_responses, args, config, tmp_path):
+    args.file = str(tmp_path / "missing.json")
+    assert dsctl.flow(args, config) is False
+    assert len(mocked_responses.calls) == 0
+
+
+def test_main_flow_validate(mocked_responses, args, config, token_url, data_structure, data_structure_with_meta):
+    mocked_responses.add(responses.GET, token_url, json={"accessToken": "abcd"}, status=200)
+    mocked_responses.add(
         responses.POST,
         f"{config.ds_url}/validation-requests",
         status=200,
@@ -296,12 +437,17 @@ def test_main_flow_validate(mocker, args, config, token_url, data_structure, dat
     assert dsctl.flow(args, config) is True
 
 
-@responses.activate
-def test_main_flow_promote_to_dev(mocker, args, config, token_url, deployment):
-    mocker.patch.object(args, 'promote_to_dev', True)
-    mocker.patch.object(args, 'promote_to_prod', False)
-    responses.add(responses.GET, token_url, json={"accessToken": "abcd"}, status=200)
-    responses.add(
+@pytest.mark.parametrize("promote_to_dev,promote_to_prod,source,target", [
+    (True, False, "VALIDATED", "DEV"),
+    (False, True, "DEV", "PROD"),
+])
+def test_main_flow_promote(
+    mocked_responses, args, config, token_url, deployment, promote_to_dev, promote_to_prod, source, target
+):
+    args.promote_to_dev = promote_to_dev
+    args.promote_to_prod = promote_to_prod
+    mocked_responses.add(responses.GET, token_url, json={"accessToken": "abcd"}, status=200)
+    mocked_responses.add(
         responses.POST,
         f"{config.ds_url}/deployment-requests",
         status=200,
@@ -311,32 +457,76 @@ def test_main_flow_promote_to_dev(mocker, args, config, token_url, deployment):
             "vendor": deployment.data_structure.vendor,
             "format": deployment.data_structure.format,
             "version": str(deployment.version),
-            "source": "VALIDATED",
-            "target": "DEV",
+            "source": source,
+            "target": target,
             "message": "No message provided"
         })]
     )
     assert dsctl.flow(args, config) is True
 
 
-@responses.activate
-def test_main_flow_promote_to_prod(mocker, args, config, token_url, deployment):
-    mocker.patch.object(args, 'promote_to_dev', False)
-    mocker.patch.object(args, 'promote_to_prod', True)
-    responses.add(responses.GET, token_url, json={"accessToken": "abcd"}, status=200)
-    responses.add(
-        responses.POST,
-        f"{config.ds_url}/deployment-requests",
-        status=200,
-        json={"success": True},
-        match=[matchers.json_params_matcher({
-            "name": deployment.data_structure.name,
-            "vendor": deployment.data_structure.vendor,
-            "format": deployment.data_structure.format,
-            "version": str(deployment.version),
-            "source": "DEV",
-            "target": "PROD",
-            "message": "No message provided"
-        })]
-    )
-    assert dsctl.flow(args, config) is True
+@pytest.fixture
+def batch_file(tmp_path, data_structure):
+    paths = []
+    for version in ("1-0-0", "1-0-1"):
+        path = tmp_path / f"{version}.json"
+        path.write_text(dumps({"self": {**data_structure["self"], "version": version}}))
+        paths.append(str(path))
+    batch_file = tmp_path / "batch.txt"
+    batch_file.write_text("\n".join(paths) + "\n\n")
+    return batch_file
+
+
+def test_batch_flow_validate(mocked_responses, args, config, token_url, batch_file):
+    args.batch = str(batch_file)
+    mocked_responses.add(responses.GET, token_url, json={"accessToken": "abcd"}, status=200)
+    mocked_responses.add(responses.POST, f"{config.ds_url}/validation-requests", status=200, json={"success": True})
+    assert dsctl.batch_flow(args, config) is True
+    assert len(mocked_responses.calls) == 3
+
+
+def test_batch_flow_fails_if_any_fails(mocked_responses, args, config, token_url, batch_file):
+    args.batch = str(batch_file)
+    mocked_responses.add(responses.GET, token_url, json={"accessToken": "abcd"}, status=200)
+    mocked_responses.add(responses.POST, f"{config.ds_url}/validation-requests", status=200, json={"success": True})
+    mocked_responses.add(responses.POST, f"{config.ds_url}/validation-requests", status=400)
+    assert dsctl.batch_flow(args, config) is False
+
+
+def test_batch_flow_missing_batch_file(args, config, tmp_path):
+    args.batch = str(tmp_path / "missing.txt")
+    args.token = "abcd"
+    assert dsctl.batch_flow(args, config) is False
+
+
+def test_batch_flow_with_token_shares_one_session(mocked_responses, args, config, batch_file):
+    args.batch = str(batch_file)
+    args.token = "abcd"
+    mocked_responses.add(responses.POST, f"{config.ds_url}/validation-requests", status=200, json={"success": True})
+    dsctl.get_session.cache_clear()
+    assert dsctl.batch_flow(args, config) is True
+    assert dsctl.get_session.cache_info().misses == 1
+    assert len(mocked_responses.calls) == 2
+
+
+def test_batch_flow_invalid_input_skips_token_request(mocked_responses, args, config, batch_file, tmp_path):
+    batch_file.write_text(batch_file.read_text() + str(tmp_path / "missing.json"))
+    args.batch = str(batch_file)
+    assert dsctl.batch_flow(args, config) is False
+    assert len(mocked_responses.calls) == 0
+
+
+@pytest.mark.parametrize("content", ["", "\n\n", "-\n"])
+def test_batch_flow_rejects_batch_file(args, config, tmp_path, content):
+    batch_file = tmp_path / "batch.txt"
+    batch_file.write_text(content)
+    args.batch = str(batch_file)
+    args.token = "abcd"
+    assert dsctl.batch_flow(args, config) is False
+
+
+def test_batch_not_allowed_with_token_only(mocker):
+    mocker.patch.object(sys, 'argv', ['dsctl', '--token-only', '--batch', 'batch.txt'])
+    with pytest.raises(SystemExit) as e:
+        dsctl.parse_arguments()
+    assert e.value.code == 2